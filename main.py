@@ -1,21 +1,53 @@
+import numpy as np
 import pandas as pd
-import json
+from pathlib import Path
+from google.protobuf import text_format
+from ortools.glop import parameters_pb2 as glop_parameters_pb2
+from ortools.linear_solver import linear_solver_pb2
 from ortools.linear_solver import pywraplp
 
+# Use orjson to parse the data files when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Use numba to compile the sensibility analysis classification when it is installed
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """leave the function as plain python when numba is not installed"""
+        return lambda function: function
+
+# Name of each kind of constraint, to be formatted with its location
+CONSTRAINT_NAMES = {
+    "production": "c01_production_%s",
+    "demand": "c02_demand_%s",
+    "fixed": "c03_fixed_%s_%s",
+}
+
+# Conclusion of each row of the sensibility analysis
+NOT_REPORTED, REMAIN_EQUAL, REDUCED, INCREASED = -1, 0, 1, 2
+
+
+def solve_problems_using_ortools_linear_solver(data_files):
+    """solve the problem for each data file reusing the same or-tools linear solver"""
+    # Instantiate a Glop solver once for all the data files
+    solver = pywraplp.Solver.CreateSolver("GLOP")
 
-def solve_problem_using_ortools_linear_solver(data_file):
-    """solve the problem using or-tools linear solver and print results"""
-    ### Load data ###
+    for data_file in data_files:
+        # Read the whole json file and return the data as a dictionary
+        data = json_loads(Path(data_file).read_bytes())
 
-    # Open json file with data
-    f = open(data_file)
+        # Remove the model of the previous data file
+        solver.Clear()
 
-    # Returns the data as a dictionary
-    data = json.load(f)
+        solve_problem_using_ortools_linear_solver(solver, data)
 
-    # Close the file
-    f.close()
 
+def solve_problem_using_ortools_linear_solver(solver, data):
+    """solve the problem using or-tools linear solver and print results"""
     ### Create the objects that the optimization model needs ###
 
     # Lists with sources and customers
@@ -26,71 +58,98 @@ def solve_problem_using_ortools_linear_solver(data_file):
     pSourceProduction = data["pSourceProduction"]
     pCustomerDemand = data["pCustomerDemand"]
 
-    # Transportation costs for each source and customer
-    pTransportationCosts = {tuple(item["index"]): item["value"] for item in data["pTransportationCosts"]}
+    # Position of each source and customer in their lists
+    source_index = {s: i for i, s in enumerate(sSources)}
+    customer_index = {c: j for j, c in enumerate(sCustomers)}
 
     # List with the available combinations of sources and customers
-    sSources_Customers = [tuple(item["index"]) for item in data["pTransportationCosts"]]
+    arcs = [tuple(item["index"]) for item in data["pTransportationCosts"]]
+    arc_index = {a: k for k, a in enumerate(arcs)}
 
-    # Quantity that is mandatory to move between each source and customer
-    pFixedTransportation = {tuple(item["index"]): item["value"] for item in data["pFixedTransportation"]}
+    # Source and customer position of each available combination
+    arc_source = np.fromiter((source_index[s] for s, _ in arcs), dtype=np.int32, count=len(arcs))
+    arc_customer = np.fromiter((customer_index[c] for _, c in arcs), dtype=np.int32, count=len(arcs))
 
-    ### Create the model ###
-
-    # Instantiate a Glop solver and naming it
-    solver = pywraplp.Solver.CreateSolver("GLOP")
+    # Transportation costs for each available combination
+    pTransportationCosts = np.fromiter(
+        (item["value"] for item in data["pTransportationCosts"]), dtype=np.float64, count=len(arcs)
+    )
 
-    # Create the decision variables
-    vQuantityExchanged = {
-        (s, c):  solver.NumVar(0.0, solver.infinity(), "quantity_in_tons_" + str(s) + "_" + str(c))
-        for s in sSources for c in sCustomers if (s, c) in sSources_Customers
+    # Quantity that is mandatory to move, only for the combinations that are really fixed
+    pFixedTransportation = {
+        arc_index[tuple(item["index"])]: item["value"] for item in data["pFixedTransportation"] if item["value"]
     }
 
-    # print("Number of variables =", solver.NumVariables())
+    # Available combinations for each source and for each customer
+    arcs_of_source = group_arcs(arc_source, len(sSources))
+    arcs_of_customer = group_arcs(arc_customer, len(sCustomers))
+
+    ### Create the model ###
+
+    # Build the whole model as a proto and load it into the solver in one call
+    model = linear_solver_pb2.MPModelProto()
+    model.maximize = False
 
-    # Create the constraints
+    # Create the decision variables, with the transportation costs as objective coefficients.
+    # Variables and constraints are left unnamed; their names are only built to print the results
+    for cost in pTransportationCosts.tolist():
+        variable = model.variable.add()
+        variable.lower_bound = 0.0
+        variable.upper_bound = solver.infinity()
+        variable.objective_coefficient = cost
+
+    # Create the constraints, keeping the kind and location of each one in creation order
+    constraint_meta = []
 
     # Production limit for each source
-    for s in sSources:
-        solver.Add(
-            sum(
-                vQuantityExchanged[s, c] for c in sCustomers if (s, c) in sSources_Customers
-            )
-            <= pSourceProduction[s],
-            "c01_production_%s" % s
-        )
+    for s, source_arcs in zip(sSources, arcs_of_source):
+        constraint = model.constraint.add()
+        constraint.lower_bound = -solver.infinity()
+        constraint.upper_bound = pSourceProduction[s]
+        constraint_meta.append(("production", s))
+        constraint.var_index.extend(source_arcs.tolist())
+        constraint.coefficient.extend([1.0] * len(source_arcs))
 
     # Demand limit for each customer
-    for c in sCustomers:
-        solver.Add(
-            sum(
-                vQuantityExchanged[s, c] for s in sSources if (s, c) in sSources_Customers
-            )
-            >= pCustomerDemand[c],
-            "c02_demand_%s" % c
-        )
+    for c, customer_arcs in zip(sCustomers, arcs_of_customer):
+        constraint = model.constraint.add()
+        constraint.lower_bound = pCustomerDemand[c]
+        constraint.upper_bound = solver.infinity()
+        constraint_meta.append(("demand", c))
+        constraint.var_index.extend(customer_arcs.tolist())
+        constraint.coefficient.extend([1.0] * len(customer_arcs))
 
     # Quantity that is mandatory to move between each source and each customer
-    for s in sSources:
-        for c in sCustomers:
-            if (s, c) in sSources_Customers and pFixedTransportation[s, c]:
-                solver.Add(
-                    vQuantityExchanged[s, c] == pFixedTransportation[s, c],
-                    "c03_fixed_%s_%s" % (s, c)
-                )
+    for k, quantity in pFixedTransportation.items():
+        s, c = arcs[k]
+        constraint = model.constraint.add()
+        constraint.lower_bound = quantity
+        constraint.upper_bound = quantity
+        constraint_meta.append(("fixed", (s, c)))
+        constraint.var_index.append(k)
+        constraint.coefficient.append(1.0)
+
+    error_message = solver.LoadModelFromProtoKeepNames(model)
+    if error_message:
+        print("The model could not be loaded:", error_message)
+        return
+
+    # Decision variables of the loaded model, in the same order as the arcs
+    vQuantityExchanged = solver.variables()
 
+    # print("Number of variables =", solver.NumVariables())
     # print("Number of constraints =", solver.NumConstraints())
 
-    # Create objective function
-    solver.Minimize(
-        sum(
-            pTransportationCosts[s, c] * vQuantityExchanged[s, c]
-            for s in sSources for c in sCustomers if (s, c) in sSources_Customers
-        )
-    )
-
     ### Solve the model ###
-    status_code = solver.Solve()
+
+    # Transportation problems are small and well scaled, so skip scaling, presolve and cost perturbation
+    solver_parameters = pywraplp.MPSolverParameters()
+    solver_parameters.SetIntegerParam(pywraplp.MPSolverParameters.SCALING, pywraplp.MPSolverParameters.SCALING_OFF)
+    solver_parameters.SetIntegerParam(pywraplp.MPSolverParameters.PRESOLVE, pywraplp.MPSolverParameters.PRESOLVE_OFF)
+    glop_parameters = glop_parameters_pb2.GlopParameters(perturb_costs_in_dual_simplex=False)
+    solver.SetSolverSpecificParametersAsString(text_format.MessageToString(glop_parameters))
+
+    status_code = solver.Solve(solver_parameters)
 
     ### Print results if we have get an optimal solution ###
     if status_code != solver.FEASIBLE and status_code != solver.OPTIMAL:
@@ -110,86 +169,106 @@ def solve_problem_using_ortools_linear_solver(data_file):
         print("Total transportation cost: ", solver.Objective().Value(), "\n")
 
         print("Quantity exchanged between sources and customers:")
-        dict_quantity_sources_customers = {
-            (s, c): vQuantityExchanged[s, c].solution_value()
-            for s in sSources for c in sCustomers
-            if (s, c) in sSources_Customers and vQuantityExchanged[s, c].solution_value() > 0
-        }
-        df_quantity_sources_customers = pd.DataFrame(dict_quantity_sources_customers.values(),
-                                                     index=pd.MultiIndex.from_tuples(
-                                                         dict_quantity_sources_customers.keys()),
-                                                     columns=['Quantity']
-                                                     ).reset_index(names=['Source', 'Customer'])
+        variable_values = np.fromiter(
+            (v.solution_value() for v in vQuantityExchanged), dtype=np.float64, count=len(vQuantityExchanged)
+        )
+        used_arcs = np.flatnonzero(variable_values > 0).tolist()
+        df_quantity_sources_customers = pd.DataFrame({
+            'Source': [arcs[k][0] for k in used_arcs],
+            'Customer': [arcs[k][1] for k in used_arcs],
+            'Quantity': variable_values[used_arcs]
+        })
         print(df_quantity_sources_customers)
         print("\n")
 
         print("Sensibility analysis - constraints:")
-        activities = solver.ComputeConstraintActivities()
-        list_sensibility_analysis_constraints = [
-            {
-                'Constraint': c.name(),
-                'Slack': c.ub() - activities[i] if c.ub() - activities[i] != float("inf") else 0.0,
-                'Shadow price': c.dual_value()
-            }
-            for i, c in enumerate(solver.constraints())
-        ]
-        df_sensibility_analysis_constraints = pd.DataFrame(list_sensibility_analysis_constraints)
+        constraints = solver.constraints()
+        constraint_names = [CONSTRAINT_NAMES[kind] % location for kind, location in constraint_meta]
+        constraint_ubs = np.fromiter((c.ub() for c in constraints), dtype=np.float64, count=len(constraints))
+        shadow_prices = np.fromiter((c.dual_value() for c in constraints), dtype=np.float64, count=len(constraints))
+        activities = np.asarray(solver.ComputeConstraintActivities(), dtype=np.float64)
+        # Demand constraints have no upper bound, so their slack is reported as 0
+        slacks = constraint_ubs - activities
+        slacks = np.where(np.isposinf(slacks), 0.0, slacks)
+        df_sensibility_analysis_constraints = pd.DataFrame({
+            'Constraint': constraint_names,
+            'Slack': slacks,
+            'Shadow price': shadow_prices
+        })
         print(df_sensibility_analysis_constraints)
         print("\n")
 
         # Conclusions
-        df_sensibility_analysis_constraints[
-            df_sensibility_analysis_constraints['Slack'] == 0
-            ].apply(
-            lambda row:
-            print_conclusions_constraints_sensibility_analysis(row['Constraint'], row['Shadow price'], sSources), axis=1)
+        shadow_prices = np.round(shadow_prices, 2)
+        conclusions = classify_sensibility_analysis(shadow_prices, slacks == 0)
+        for i in np.flatnonzero(conclusions != NOT_REPORTED).tolist():
+            print_conclusions_constraints_sensibility_analysis(constraint_meta[i], shadow_prices[i], conclusions[i])
         print("\n")
 
         print("Sensibility analysis - variables:")
-        list_sensibility_analysis_variables = [
-            {
-                'Variable': v.name(),
-                'Value': v.solution_value(),
-                'Reduced cost': v.reduced_cost()
-            }
-            for v in solver.variables()]
-        df_sensibility_analysis_variables = pd.DataFrame(list_sensibility_analysis_variables)
+        variable_names = ["quantity_in_tons_%s_%s" % a for a in arcs]
+        reduced_costs = np.fromiter(
+            (v.reduced_cost() for v in vQuantityExchanged), dtype=np.float64, count=len(vQuantityExchanged)
+        )
+        df_sensibility_analysis_variables = pd.DataFrame({
+            'Variable': variable_names,
+            'Value': variable_values,
+            'Reduced cost': reduced_costs
+        })
         print(df_sensibility_analysis_variables)
         print("\n")
 
         # Conclusions
-        df_sensibility_analysis_variables[
-            df_sensibility_analysis_variables['Value'] == 0
-            ].apply(
-            lambda row:
-            print_conclusions_variables_sensibility_analysis(row['Variable'], row['Reduced cost']), axis=1)
+        reduced_costs = np.round(reduced_costs, 2)
+        conclusions = classify_sensibility_analysis(reduced_costs, variable_values == 0)
+        for k in np.flatnonzero(conclusions != NOT_REPORTED).tolist():
+            print_conclusions_variables_sensibility_analysis(arcs[k], reduced_costs[k], conclusions[k])
         print("\n")
 
 
-def print_conclusions_constraints_sensibility_analysis(constraint_name, shadow_price, sources):
+def group_arcs(arc_location, number_of_locations):
+    """group the positions of the arcs by source or customer, keeping the data file order"""
+    order = np.argsort(arc_location, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(arc_location, minlength=number_of_locations))[:-1])
+
+
+@njit(cache=True)
+def classify_sensibility_analysis(rounded_values, reported):
+    """classify each reported row of the sensibility analysis by the sign of its rounded value"""
+    conclusions = np.empty(rounded_values.shape[0], np.int8)
+    for i in range(rounded_values.shape[0]):
+        if not reported[i]:
+            conclusions[i] = NOT_REPORTED
+        elif rounded_values[i] < 0:
+            conclusions[i] = REDUCED
+        elif rounded_values[i] > 0:
+            conclusions[i] = INCREASED
+        else:
+            conclusions[i] = REMAIN_EQUAL
+    return conclusions
+
+
+def print_conclusions_constraints_sensibility_analysis(constraint, shadow_price, conclusion):
     """print conclusions of the constraints sensibility analysis"""
-    # Find the constraint number and the constraint location using the constraint name
-    constraint_number = int(str(constraint_name)[2:3])
-    location = str(constraint_name)[-3:]
-    # Round to 2 decimals
-    shadow_price = round(shadow_price, 2)
-    if constraint_number <= 2 and location in sources:
-        if shadow_price < 0:
+    # The constraint kind and its location (source or customer)
+    constraint_kind, location = constraint
+    if constraint_kind == "production":
+        if conclusion == REDUCED:
             print("The total transportation cost would be reduced by",
                   abs(shadow_price),
                   "euros for each additional ton available in", location)
-        elif shadow_price > 0:
+        elif conclusion == INCREASED:
             print("The total transportation cost would be increased in",
                   shadow_price,
                   "euros for each additional ton available in", location)
         else:
             print("The total transportation cost would remain equal for each additional ton available in", location)
-    elif constraint_number <= 2:
-        if shadow_price < 0:
+    elif constraint_kind == "demand":
+        if conclusion == REDUCED:
             print("The total transportation cost would be reduced by",
                   abs(shadow_price),
                   "euros for each additional ton supply at", location)
-        elif shadow_price > 0:
+        elif conclusion == INCREASED:
             print("The total transportation cost would be increased in",
                   shadow_price,
                   "euros for each additional ton supply at", location)
@@ -197,18 +276,15 @@ def print_conclusions_constraints_sensibility_analysis(constraint_name, shadow_p
             print("The total transportation cost would remain equal for each additional ton supply at", location)
 
 
-def print_conclusions_variables_sensibility_analysis(variable_name, reduced_cost):
+def print_conclusions_variables_sensibility_analysis(route, reduced_cost, conclusion):
     """print conclusions of the variables sensibility analysis"""
-    # Find the source and the customer using the variable name
-    source = variable_name[-7:-4]
-    customer = variable_name[-3:]
-    # Round to 2 decimals
-    reduced_cost = round(reduced_cost, 2)
-    if reduced_cost < 0:
+    # The source and the customer of the route
+    source, customer = route
+    if conclusion == REDUCED:
         print("The total transportation cost would be reduced by",
               abs(reduced_cost),
               "euros for each ton supply from", source, "to", customer)
-    elif reduced_cost > 0:
+    elif conclusion == INCREASED:
         print("The total cost would be increased in",
               reduced_cost,
               "euros for each ton supply from", source, "to", customer)
@@ -217,29 +293,30 @@ def print_conclusions_variables_sensibility_analysis(variable_name, reduced_cost
 
 
 # Solve some transportation problems
-
-# Base case
-solve_problem_using_ortools_linear_solver("./data/data_0.json")
-
-# Sensibility analysis - sources
-# Using the base case, we move one ton of supply capacity from Gou to Arn and
-# the objetive function improves in 0.2 euros (shadow price for Arn in the base case)
-# solve_problem_using_ortools_linear_solver("./data/data_1.json")
-
-# Sensibility analysis - customers - 1
-# Using the base case, we increase the demand in Lon in one ton, and
-# we increase one ton of supply capacity in Gou (Gou is the only source for Lon).
-# Then the objetive function gets worse in 2.5 euros (shadow price for Lon in the base case)
-# solve_problem_using_ortools_linear_solver("./data/data_2.json")
-
-# Sensibility analysis - customers - 2
-# Using the base case, we increase the demand in Ber in one ton, and
-# we increase one ton of supply capacity in Gou (Arn is the only source for Ber).
-# Then the objetive function gets worse in 2.7 euros (shadow price for Ber in the base case)
-# solve_problem_using_ortools_linear_solver("./data/data_3.json")
-
-# Sensibility analysis - routes
-# Using the base case, we fixed a transportation between Arn and Ams equal to 1 ton,
-# using pFixedTransportation and c03_fixed_%s_%s.
-# The objetive function gets worse in 0.6 euros (reduced cost for the transportation between Arn and Ams)
-# solve_problem_using_ortools_linear_solver("./data/data_4.json")
+solve_problems_using_ortools_linear_solver([
+    # Base case
+    "./data/data_0.json",
+
+    # Sensibility analysis - sources
+    # Using the base case, we move one ton of supply capacity from Gou to Arn and
+    # the objetive function improves in 0.2 euros (shadow price for Arn in the base case)
+    # "./data/data_1.json",
+
+    # Sensibility analysis - customers - 1
+    # Using the base case, we increase the demand in Lon in one ton, and
+    # we increase one ton of supply capacity in Gou (Gou is the only source for Lon).
+    # Then the objetive function gets worse in 2.5 euros (shadow price for Lon in the base case)
+    # "./data/data_2.json",
+
+    # Sensibility analysis - customers - 2
+    # Using the base case, we increase the demand in Ber in one ton, and
+    # we increase one ton of supply capacity in Gou (Arn is the only source for Ber).
+    # Then the objetive function gets worse in 2.7 euros (shadow price for Ber in the base case)
+    # "./data/data_3.json",
+
+    # Sensibility analysis - routes
+    # Using the base case, we fixed a transportation between Arn and Ams equal to 1 ton,
+    # using pFixedTransportation and c03_fixed_%s_%s.
+    # The objetive function gets worse in 0.6 euros (reduced cost for the transportation between Arn and Ams)
+    # "./data/data_4.json",
+])